@@ -1,131 +1,118 @@
+import asyncio
 import datetime
+import functools
 import logging.config
 from environs import Env
 from seller import download_stock
-import requests
-from seller import divide, price_conversion
+import marketplace_client
+from marketplace_client import (
+    OFFER_IDS_CACHE_DIR,
+    MarketplaceClient,
+    create_session,
+    divide,
+    gather_chunks,
+    get_cached_offer_ids,
+    report_error,
+)
 
 logger = logging.getLogger(__file__)
 
+YANDEX_URL = "https://api.partner.market.yandex.ru/"
 
-def get_product_list(page, campaign_id, access_token):
+
+async def get_product_list(client, page, campaign_id):
     """
     Получает список товаров (артикулов) из кампании на Яндекс.Маркете.
 
     Args:
+        client (MarketplaceClient): Клиент API Яндекс.Маркета.
         page (str): Токен страницы для пагинации.
         campaign_id (str): Идентификатор кампании на Яндекс.Маркете.
-        access_token (str): Токен доступа для аутентификации в API.
 
     Returns:
         dict: Результат запроса в формате JSON.
 
     Example:
-        result = get_product_list("token123", "campaign456", "access_token_xyz")
+        result = await get_product_list(client, "token123", "campaign456")
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {
         "page_token": page,
         "limit": 200,
     }
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
-    response.raise_for_status()
-    response_object = response.json()
+    response_object = await client.request(
+        "GET", f"campaigns/{campaign_id}/offer-mapping-entries", params=payload
+    )
     return response_object.get("result")
 
 
-def update_stocks(stocks, campaign_id, access_token):
+async def update_stocks(client, stocks, campaign_id):
     """
     Обновляет остатки товаров на Яндекс.Маркете.
 
     Args:
+        client (MarketplaceClient): Клиент API Яндекс.Маркета.
         stocks (list): Список остатков для обновления.
         campaign_id (str): Идентификатор кампании на Яндекс.Маркете.
-        access_token (str): Токен доступа для аутентификации в API.
 
     Returns:
         dict: Результат запроса в формате JSON.
 
     Example:
-        result = update_stocks([stock1, stock2], "campaign456", "access_token_xyz")
+        result = await update_stocks(client, [stock1, stock2], "campaign456")
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {"skus": stocks}
-    url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object
+    return await client.request("PUT", f"campaigns/{campaign_id}/offers/stocks", payload)
 
 
-def update_price(prices, campaign_id, access_token):
+async def update_price(client, prices, campaign_id):
     """
     Обновляет цены на товары на Яндекс.Маркете.
 
     Args:
+        client (MarketplaceClient): Клиент API Яндекс.Маркета.
         prices (list): Список цен для обновления.
         campaign_id (str): Идентификатор кампании на Яндекс.Маркете.
-        access_token (str): Токен доступа для аутентификации в API.
 
     Returns:
         dict: Результат запроса в формате JSON.
 
     Example:
-        result = update_price([price1, price2], "campaign456", "access_token_xyz")
+        result = await update_price(client, [price1, price2], "campaign456")
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {"offers": prices}
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
-    return response_object
+    return await client.request("POST", f"campaigns/{campaign_id}/offer-prices/updates", payload)
 
 
-def get_offer_ids(campaign_id, market_token):
+async def get_offer_ids(client, campaign_id):
     """
        Получает список артикулов товаров на Яндекс.Маркете для указанной кампании.
 
        Args:
+           client (MarketplaceClient): Клиент API Яндекс.Маркета.
            campaign_id (str): Идентификатор кампании на Яндекс.Маркете.
-           market_token (str): Токен доступа для аутентификации в API.
 
        Returns:
            list: Список артикулов товаров на Яндекс.Маркете.
 
        Example:
-           result = get_offer_ids("campaign456", "access_token_xyz")
+           result = await get_offer_ids(client, "campaign456")
        """
-    page = ""
-    product_list = []
-    while True:
-        some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
-        page = some_prod.get("paging").get("nextPageToken")
-        if not page:
-            break
     offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
+    next_page = asyncio.create_task(get_product_list(client, "", campaign_id))
+    try:
+        while next_page:
+            some_prod = await next_page
+            page = some_prod.get("paging").get("nextPageToken")
+            # Следующая страница загружается, пока разбираем текущую
+            next_page = None
+            if page:
+                next_page = asyncio.create_task(get_product_list(client, page, campaign_id))
+            for product in some_prod.get("offerMappingEntries"):
+                offer_ids.append(product.get("offer").get("shopSku"))
+    finally:
+        # Не оставляем загрузку следующей страницы висеть после ошибки или отмены
+        if next_page and not next_page.done():
+            next_page.cancel()
     return offer_ids
 
 
@@ -134,53 +121,24 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
     Создает список остатков товаров на основе данных из источника данных.
 
     Args:
-        watch_remnants (list): Список данных об остатках товаров.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров.
         offer_ids (list): Список артикулов товаров на Яндекс.Маркете.
         warehouse_id (str): Идентификатор склада на Яндекс.Маркете.
 
     Returns:
-        list: Список остатков товаров для обновления на Яндекс.Маркете.
+        tuple: Список ненулевых остатков и полный список остатков для обновления на Яндекс.Маркете.
     """
-    stocks = list()
-    date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
-                {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
-                }
-            )
-            offer_ids.remove(str(watch.get("Код")))
-    for offer_id in offer_ids:
-        stocks.append(
-            {
-                "sku": offer_id,
-                "warehouseId": warehouse_id,
-                "items": [
-                    {
-                        "count": 0,
-                        "type": "FIT",
-                        "updatedAt": date,
-                    }
-                ],
-            }
-        )
-    return stocks
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    date = now.isoformat().replace("+00:00", "Z")
+    return marketplace_client.create_stocks(
+        watch_remnants,
+        offer_ids,
+        lambda sku, count: {
+            "sku": sku,
+            "warehouseId": warehouse_id,
+            "items": [{"count": count, "type": "FIT", "updatedAt": date}],
+        },
+    )
 
 
 def create_prices(watch_remnants, offer_ids):
@@ -188,102 +146,121 @@ def create_prices(watch_remnants, offer_ids):
     Создает список цен на товары на основе данных из источника данных.
 
     Args:
-        watch_remnants (list): Список данных о ценах на товары.
+        watch_remnants (pandas.DataFrame): Таблица цен на товары.
         offer_ids (list): Список артикулов товаров на Яндекс.Маркете.
 
     Returns:
         list: Список цен на товары для обновления на Яндекс.Маркете.
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    "currencyId": "RUR",
-                },
-            }
-            prices.append(price)
-    return prices
-
-
-async def upload_prices(watch_remnants, campaign_id, market_token):
+    return marketplace_client.create_prices(
+        watch_remnants,
+        offer_ids,
+        lambda offer_id, price: {
+            "id": offer_id,
+            "price": {
+                "value": int(price),
+                "currencyId": "RUR",
+            },
+        },
+    )
+
+
+async def upload_prices(client, watch_remnants, offer_ids, campaign_id):
     """
     Загружает цены на товары на Яндекс.Маркет из списка цен.
 
     Args:
-        watch_remnants (list): Список данных о ценах на товары.
+        client (MarketplaceClient): Клиент API Яндекс.Маркета.
+        watch_remnants (pandas.DataFrame): Таблица цен на товары.
+        offer_ids (list): Список артикулов товаров на Яндекс.Маркете.
         campaign_id (str): Идентификатор кампании на Яндекс.Маркете.
-        market_token (str): Токен доступа для аутентификации в API.
 
     Returns:
         list: Список цен на товары, загруженных на Яндекс.Маркет.
 
     Example:
-        result = await upload_prices([price1, price2], "campaign456", "access_token_xyz")
+        result = await upload_prices(client, watch_remnants, offer_ids, "campaign456")
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    await gather_chunks(
+        update_price(client, some_prices, campaign_id)
+        for some_prices in divide(prices, 500)
+    )
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(client, watch_remnants, offer_ids, campaign_id, warehouse_id):
     """
     Загружает остатки товаров на Яндекс.Маркет из списка остатков.
 
     Args:
-        watch_remnants (list): Список данных об остатках товаров.
+        client (MarketplaceClient): Клиент API Яндекс.Маркета.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров.
+        offer_ids (list): Список артикулов товаров на Яндекс.Маркете.
         campaign_id (str): Идентификатор кампании на Яндекс.Маркете.
-        market_token (str): Токен доступа для аутентификации в API.
         warehouse_id (str): Идентификатор склада на Яндекс.Маркете.
 
     Returns:
         tuple: Список остатков товаров, которые были загружены, и полный список остатков.
 
     Example:
-        result = await upload_stocks([stock1, stock2], "campaign456", "access_token_xyz", "warehouse123")
+        result = await upload_stocks(client, watch_remnants, offer_ids, "campaign456", "warehouse123")
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
-    stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks))
+    not_empty, stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
+    await gather_chunks(
+        update_stocks(client, some_stock, campaign_id)
+        for some_stock in divide(stocks, 2000)
+    )
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     market_token = env.str("MARKET_TOKEN")
     campaign_fbs_id = env.str("FBS_ID")
     campaign_dbs_id = env.str("DBS_ID")
     warehouse_fbs_id = env.str("WAREHOUSE_FBS_ID")
     warehouse_dbs_id = env.str("WAREHOUSE_DBS_ID")
+    offer_ids_ttl = env.int("OFFER_IDS_TTL", 3600)
+    offer_ids_cache_dir = env.path("OFFER_IDS_CACHE_DIR", OFFER_IDS_CACHE_DIR)
 
     watch_remnants = download_stock()
-    try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
-    except requests.exceptions.ReadTimeout:
-        print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
-        print(error, "Ошибка соединения")
-    except Exception as error:
-        print(error, "ERROR_2")
+    async with create_session() as session:
+        client = MarketplaceClient(
+            YANDEX_URL,
+            {"Authorization": f"Bearer {market_token}"},
+            session,
+        )
+        try:
+            fbs_offer_ids, dbs_offer_ids = await asyncio.gather(
+                get_cached_offer_ids(
+                    f"yandex_{campaign_fbs_id}",
+                    functools.partial(get_offer_ids, client, campaign_fbs_id),
+                    offer_ids_ttl,
+                    offer_ids_cache_dir,
+                ),
+                get_cached_offer_ids(
+                    f"yandex_{campaign_dbs_id}",
+                    functools.partial(get_offer_ids, client, campaign_dbs_id),
+                    offer_ids_ttl,
+                    offer_ids_cache_dir,
+                ),
+            )
+            # FBS и DBS обновляются независимо: ошибка в одной кампании не отменяет остальные загрузки
+            results = await asyncio.gather(
+                upload_stocks(client, watch_remnants, fbs_offer_ids, campaign_fbs_id, warehouse_fbs_id),
+                upload_prices(client, watch_remnants, fbs_offer_ids, campaign_fbs_id),
+                upload_stocks(client, watch_remnants, dbs_offer_ids, campaign_dbs_id, warehouse_dbs_id),
+                upload_prices(client, watch_remnants, dbs_offer_ids, campaign_dbs_id),
+                return_exceptions=True,
+            )
+        except Exception as error:
+            report_error(error)
+            return
+        for result in results:
+            if isinstance(result, BaseException):
+                report_error(result)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,428 @@
+import asyncio
+import functools
+import itertools
+import email.utils
+import logging.config
+import os
+import random
+import re
+import time
+from pathlib import Path
+import aiohttp
+from aiolimiter import AsyncLimiter
+import numpy as np
+import orjson
+import pandas as pd
+
+logger = logging.getLogger(__file__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TOO_MANY_REQUESTS = 429
+# Отбрасывает копейки после точки и все нецифровые символы: "5'990.00 руб." -> "5990"
+PRICE_RE = re.compile(r"\..*|[^0-9]", re.DOTALL)
+OFFER_IDS_CACHE_DIR = Path(__file__).resolve().parent
+
+
+def parse_retry_after(headers):
+    """
+    Возвращает задержку из заголовка Retry-After в секундах.
+
+    Поддерживаются оба формата заголовка: число секунд и HTTP-дата.
+
+    Args:
+        headers (Mapping): Заголовки ответа.
+
+    Returns:
+        float: Задержка в секундах или None, если заголовка нет или его не удалось разобрать.
+
+    Examples:
+        Пример корректного использования:
+        parse_retry_after({"Retry-After": "5"})
+
+        Пример некорректного использования:
+        parse_retry_after("5")
+    """
+    retry_after = headers.get("Retry-After") if headers else None
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def retry_with_backoff(max_attempts=3, base=1.0, max_wait=30.0):
+    """
+    Повторяет запрос к API при ответах 429 и 5xx с экспоненциальной задержкой.
+
+    К задержке добавляется случайный разброс, чтобы параллельные запросы не
+    повторялись одновременно. Если сервер вернул заголовок Retry-After, ждём
+    не меньше указанного в нём времени.
+
+    Args:
+        max_attempts (int): Максимальное количество попыток.
+        base (float): Начальная задержка в секундах.
+        max_wait (float): Максимальная задержка в секундах.
+
+    Returns:
+        function: Декоратор для асинхронной функции запроса.
+
+    Examples:
+        Пример корректного использования:
+        @retry_with_backoff(max_attempts=5)
+        async def request(self, method, path, payload=None, params=None): ...
+
+        Пример некорректного использования:
+        @retry_with_backoff
+        async def request(self, method, path, payload=None, params=None): ...
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except aiohttp.ClientResponseError as error:
+                    if error.status not in RETRY_STATUSES or attempt == max_attempts - 1:
+                        raise
+                    backoff = min(max_wait, base * 2**attempt)
+                    wait = backoff / 2 + random.uniform(0, backoff / 2)
+                    retry_after = parse_retry_after(error.headers)
+                    if retry_after is not None:
+                        wait = min(max_wait, retry_after) + random.uniform(0, base)
+                    logger.warning(
+                        "%s: HTTP %s, повтор через %.1f с", func.__name__, error.status, wait
+                    )
+                    await asyncio.sleep(wait)
+
+        return wrapper
+
+    return decorator
+
+
+def create_session():
+    """
+    Создает сессию aiohttp, общую для всех клиентов маркетплейсов.
+
+    Returns:
+        aiohttp.ClientSession: Сессия с общим пулом соединений.
+
+    Examples:
+        Пример корректного использования:
+        async with create_session() as session: ...
+
+        Пример некорректного использования:
+        session = await create_session()
+    """
+    connector = aiohttp.TCPConnector(limit=128)
+    return aiohttp.ClientSession(connector=connector)
+
+
+class MarketplaceClient:
+    """
+    Клиент API маркетплейса поверх общей сессии aiohttp.
+
+    Ограничивает частоту и количество одновременных запросов, повторяет
+    запросы при ответах 429 и 5xx и кодирует JSON через orjson. После ответа
+    429 клиент приостанавливает все свои запросы на время из Retry-After,
+    а не только тот, который получил ошибку.
+
+    Args:
+        base_url (str): Базовый адрес API маркетплейса.
+        auth_headers (dict): Заголовки авторизации.
+        session (aiohttp.ClientSession): Сессия для запросов к API.
+        rps (int): Максимальное количество запросов в секунду.
+        concurrency (int): Максимальное количество одновременных запросов.
+        max_pause (float): Максимальная пауза после ответа 429 в секундах.
+
+    Examples:
+        Пример корректного использования:
+        MarketplaceClient("https://api-seller.ozon.ru/", {"Client-Id": "client123", "Api-Key": "token123"}, session)
+
+        Пример некорректного использования:
+        MarketplaceClient("https://api-seller.ozon.ru/", "token123", session)
+    """
+
+    def __init__(self, base_url, auth_headers, session, rps=10, concurrency=32, max_pause=30.0):
+        self.base_url = base_url
+        self.headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            **auth_headers,
+        }
+        self.session = session
+        self._limiter = AsyncLimiter(rps, 1)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_pause = max_pause
+        self._blocked_until = 0.0
+
+    def _pause(self, delay):
+        """
+        Приостанавливает все запросы клиента на delay секунд.
+
+        Args:
+            delay (float): Длительность паузы в секундах.
+        """
+        loop = asyncio.get_running_loop()
+        self._blocked_until = max(self._blocked_until, loop.time() + min(delay, self._max_pause))
+
+    async def _wait_until_unblocked(self):
+        """Ждёт окончания паузы, выставленной после ответа 429."""
+        loop = asyncio.get_running_loop()
+        while (delay := self._blocked_until - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    @retry_with_backoff()
+    async def request(self, method, path, payload=None, params=None):
+        """
+        Отправляет запрос к API маркетплейса.
+
+        Args:
+            method (str): HTTP-метод.
+            path (str): Путь относительно базового адреса API.
+            payload (dict): Тело запроса.
+            params (dict): Параметры строки запроса.
+
+        Returns:
+            dict: Результат запроса в формате JSON.
+
+        Examples:
+            Пример корректного использования:
+            await client.request("POST", "v1/product/import/stocks", {"stocks": stocks})
+
+            Пример некорректного использования:
+            await client.request("POST", "v1/product/import/stocks", orjson.dumps({"stocks": stocks}))
+        """
+        data = orjson.dumps(payload) if payload is not None else None
+        url = self.base_url + path
+        async with self._semaphore:
+            await self._wait_until_unblocked()
+            async with self._limiter:
+                async with self.session.request(
+                    method, url, headers=self.headers, params=params, data=data
+                ) as response:
+                    if response.status == TOO_MANY_REQUESTS:
+                        retry_after = parse_retry_after(response.headers)
+                        self._pause(1.0 if retry_after is None else retry_after)
+                    response.raise_for_status()
+                    return orjson.loads(await response.read())
+
+
+class ChunkUploadError(Exception):
+    """
+    Ошибка загрузки одной или нескольких частей данных на маркетплейс.
+
+    Args:
+        errors (list): Ошибки каждой неудавшейся части.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"Не удалось загрузить частей: {len(errors)}")
+
+
+async def gather_chunks(coroutines):
+    """
+    Отправляет запросы по частям и дожидается завершения всех частей.
+
+    Ошибка одной части не прерывает остальные: сначала дожидаемся всех
+    запросов, а затем сообщаем обо всех ошибках сразу.
+
+    Args:
+        coroutines (Iterable): Корутины запросов для каждой части.
+
+    Returns:
+        list: Результаты запросов.
+
+    Raises:
+        ChunkUploadError: Если хотя бы одна часть не загрузилась.
+
+    Examples:
+        Пример корректного использования:
+        await gather_chunks(update_stocks(client, chunk) for chunk in divide(stocks, 100))
+
+        Пример некорректного использования:
+        await gather_chunks(update_stocks(client, stocks))
+    """
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise ChunkUploadError(errors)
+    return results
+
+
+def report_error(error):
+    """
+    Выводит сообщение об ошибке при обновлении данных на маркетплейсе.
+
+    Для ChunkUploadError выводится сообщение о каждой неудавшейся части.
+
+    Args:
+        error (BaseException): Ошибка, возникшая при обращении к API.
+
+    Examples:
+        Пример корректного использования:
+        report_error(asyncio.TimeoutError())
+
+        Пример некорректного использования:
+        report_error("timeout")
+    """
+    if isinstance(error, ChunkUploadError):
+        for chunk_error in error.errors:
+            report_error(chunk_error)
+    elif isinstance(error, asyncio.CancelledError):
+        print("Загрузка отменена")
+    elif isinstance(error, asyncio.TimeoutError):
+        print("Превышено время ожидания...")
+    elif isinstance(error, aiohttp.ClientConnectionError):
+        print(error, "Ошибка соединения")
+    else:
+        print(error, "ERROR_2")
+
+
+async def get_cached_offer_ids(cache_key, fetch_offer_ids, ttl=3600, cache_dir=OFFER_IDS_CACHE_DIR):
+    """
+    Возвращает артикулы товаров из файлового кэша или загружает их заново.
+
+    Кэш хранится в файле offer_ids_{cache_key}.json в каталоге cache_dir и
+    считается актуальным ttl секунд. Если кэша нет, он устарел, повреждён или
+    помечен временем из будущего, артикулы загружаются через fetch_offer_ids
+    и кэш перезаписывается. Ошибка записи кэша только логируется.
+
+    Args:
+        cache_key (str): Ключ кэша с префиксом маркетплейса, например "yandex_campaign456".
+        fetch_offer_ids (function): Асинхронная функция без аргументов, загружающая артикулы.
+        ttl (int): Время жизни кэша в секундах.
+        cache_dir (Path): Каталог для файлов кэша, по умолчанию рядом со скриптами.
+
+    Returns:
+        list: Список артикулов товаров на маркетплейсе.
+
+    Examples:
+        Пример корректного использования:
+        await get_cached_offer_ids("yandex_campaign456", functools.partial(get_offer_ids, client, "campaign456"))
+
+        Пример некорректного использования:
+        await get_cached_offer_ids("yandex_campaign456", get_offer_ids(client, "campaign456"))
+    """
+    cache_file = Path(cache_dir) / f"offer_ids_{cache_key}.json"
+    try:
+        cache = orjson.loads(cache_file.read_bytes())
+        # Метка из будущего (сбитые часы, чужой файл) означает, что кэшу нельзя доверять
+        if 0 <= time.time() - cache["timestamp"] < ttl:
+            return cache["offer_ids"]
+    except (OSError, orjson.JSONDecodeError, KeyError, TypeError):
+        logger.info("Кэш артикулов %s недоступен, загружаем заново", cache_file)
+    offer_ids = await fetch_offer_ids()
+    # Пишем во временный файл и подменяем кэш атомарно, чтобы параллельный запуск
+    # не прочитал недописанный JSON. Ошибка записи не должна ронять обновление.
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    try:
+        tmp_file.write_bytes(orjson.dumps({"timestamp": time.time(), "offer_ids": offer_ids}))
+        os.replace(tmp_file, cache_file)
+    except OSError as error:
+        logger.warning("Не удалось сохранить кэш артикулов %s: %s", cache_file, error)
+        tmp_file.unlink(missing_ok=True)
+    return offer_ids
+
+
+def create_stocks(watch_remnants, offer_ids, to_stock_dict):
+    """
+    Создает список остатков товаров для обновления.
+
+    Товары из offer_ids, которых нет в остатках, получают остаток 0.
+
+    Args:
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта Casio.
+        offer_ids (list): Список артикулов товаров на маркетплейсе.
+        to_stock_dict (function): Формирует остаток в схеме маркетплейса по артикулу и количеству.
+
+    Returns:
+        tuple: Кортеж, содержащий два списка - ненулевые остатки и все остатки для обновления.
+
+    Examples:
+        Пример корректного использования:
+        create_stocks(watch_remnants, ["12345", "67890"], lambda sku, count: {"offer_id": sku, "stock": count})
+
+        Пример некорректного использования:
+        create_stocks(watch_remnants, "12345", lambda sku, count: {"offer_id": sku, "stock": count})
+    """
+    offer_set = set(offer_ids)
+    codes = watch_remnants["Код"].astype(str)
+    watches = watch_remnants.assign(Код=codes)[codes.isin(offer_set)].drop_duplicates("Код")
+    counts = watches["Количество"].astype(str)
+    stock = np.where(
+        counts == ">10",
+        100,
+        np.where(counts == "1", 0, pd.to_numeric(counts, errors="coerce").fillna(0).astype(int)),
+    )
+    leftover = offer_set.difference(watches["Код"])
+    rows = itertools.chain(
+        zip(watches["Код"], stock.tolist()),
+        zip(leftover, itertools.repeat(0)),
+    )
+    stocks = []
+    not_empty = []
+    for sku, count in rows:
+        watch_stock = to_stock_dict(sku, count)
+        stocks.append(watch_stock)
+        if count != 0:
+            not_empty.append(watch_stock)
+    return not_empty, stocks
+
+
+def create_prices(watch_remnants, offer_ids, to_price_dict):
+    """
+    Создает список цен товаров для обновления.
+
+    Args:
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта Casio.
+        offer_ids (list): Список артикулов товаров на маркетплейсе.
+        to_price_dict (function): Формирует цену в схеме маркетплейса по артикулу и цене вида "5990".
+
+    Returns:
+        list: Список цен товаров для обновления.
+
+    Examples:
+        Пример корректного использования:
+        create_prices(watch_remnants, ["12345", "67890"], lambda sku, price: {"offer_id": sku, "price": price})
+
+        Пример некорректного использования:
+        create_prices(watch_remnants, "12345", lambda sku, price: {"offer_id": sku, "price": price})
+    """
+    offer_set = set(offer_ids)
+    codes = watch_remnants["Код"].astype(str)
+    watches = watch_remnants.assign(Код=codes)[codes.isin(offer_set)]
+    converted = (
+        watches["Цена"]
+        .astype(str)
+        .str.replace(PRICE_RE, "", regex=True)
+    )
+    return [to_price_dict(sku, price) for sku, price in zip(watches["Код"], converted)]
+
+
+def divide(lst, n: int):
+    """
+    Разделяет последовательность на части по n элементов.
+
+    Args:
+        lst (Iterable): Исходный список или другая последовательность.
+        n (int): Размер частей.
+
+    Yields:
+        list: Часть списка.
+
+    Examples:
+        Пример корректного использования:
+        divide([1, 2, 3, 4, 5, 6], 2)
+
+        Пример некорректного использования:
+        divide([1, 2, 3, 4, 5, 6], "2")
+    """
+    iterator = iter(lst)
+    while chunk := list(itertools.islice(iterator, n)):
+        yield chunk
@@ -1,39 +1,63 @@
+import asyncio
+import functools
 import io
 import logging.config
-import os
-import re
 import zipfile
 from environs import Env
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import marketplace_client
+from marketplace_client import (
+    OFFER_IDS_CACHE_DIR,
+    RETRY_STATUSES,
+    MarketplaceClient,
+    create_session,
+    divide,
+    gather_chunks,
+    get_cached_offer_ids,
+    report_error,
+)
 
 logger = logging.getLogger(__file__)
 
-
-def get_product_list(last_id, client_id, seller_token):
+OZON_URL = "https://api-seller.ozon.ru/"
+
+_session = requests.Session()
+_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+        ),
+    ),
+)
+
+
+async def get_product_list(client, last_id):
     """
     Получает список товаров магазина Ozon.
 
     Args:
+        client (MarketplaceClient): Клиент API Ozon.
         last_id (str): ID последнего товара в предыдущем запросе или пустая строка.
-        client_id (str): Идентификатор клиента.
-        seller_token (str): Токен продавца.
 
     Returns:
         list: Список товаров магазина Ozon.
 
     Examples:
         Пример корректного использования:
-        get_product_list("12345", "client123", "token123")
+        await get_product_list(client, "12345")
 
         Пример некорректного использования:
-        get_product_list(12345, "client123", "token123")
+        await get_product_list(client, 12345)
     """
-    url = "https://api-seller.ozon.ru/v2/product/list"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
     payload = {
         "filter": {
             "visibility": "ALL",
@@ -41,103 +65,88 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    response_object = response.json()
+    response_object = await client.request("POST", "v2/product/list", payload)
     return response_object.get("result")
 
 
-def get_offer_ids(client_id, seller_token):
+async def get_offer_ids(client):
     """
     Получает артикулы товаров магазина Ozon.
 
     Args:
-        client_id (str): Идентификатор клиента.
-        seller_token (str): Токен продавца.
+        client (MarketplaceClient): Клиент API Ozon.
 
     Returns:
         list: Список артикулов товаров магазина Ozon.
 
     Examples:
         Пример корректного использования:
-        get_offer_ids("client123", "token123")
+        await get_offer_ids(client)
 
         Пример некорректного использования:
-        get_offer_ids(12345, "token123")
+        await get_offer_ids("client123")
     """
-    last_id = ""
-    product_list = []
-    while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
-        total = some_prod.get("total")
-        last_id = some_prod.get("last_id")
-        if total == len(product_list):
-            break
     offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer_id"))
+    next_page = asyncio.create_task(get_product_list(client, ""))
+    try:
+        while next_page:
+            some_prod = await next_page
+            items = some_prod.get("items")
+            total = some_prod.get("total")
+            last_id = some_prod.get("last_id")
+            # Следующая страница загружается, пока разбираем текущую
+            next_page = None
+            if items and len(offer_ids) + len(items) < total:
+                next_page = asyncio.create_task(get_product_list(client, last_id))
+            for product in items:
+                offer_ids.append(product.get("offer_id"))
+    finally:
+        # Не оставляем загрузку следующей страницы висеть после ошибки или отмены
+        if next_page and not next_page.done():
+            next_page.cancel()
     return offer_ids
 
 
-def update_price(prices: list, client_id, seller_token):
+async def update_price(client, prices: list):
     """
     Обновляет цены товаров магазина Ozon.
 
     Args:
+        client (MarketplaceClient): Клиент API Ozon.
         prices (list): Список цен товаров для обновления.
-        client_id (str): Идентификатор клиента.
-        seller_token (str): Токен продавца.
 
     Returns:
         dict: Результат обновления цен.
 
     Examples:
         Пример корректного использования:
-        update_price([{"offer_id": "12345", "price": "5990"}], "client123", "token123")
+        await update_price(client, [{"offer_id": "12345", "price": "5990"}])
 
         Пример некорректного использования:
-        update_price({"offer_id": "12345", "price": "5990"}, "client123", "token123")
+        await update_price(client, {"offer_id": "12345", "price": "5990"})
     """
-    url = "https://api-seller.ozon.ru/v1/product/import/prices"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
-    payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return await client.request("POST", "v1/product/import/prices", {"prices": prices})
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+async def update_stocks(client, stocks: list):
     """
     Обновляет остатки товаров магазина Ozon.
 
     Args:
+        client (MarketplaceClient): Клиент API Ozon.
         stocks (list): Список остатков товаров для обновления.
-        client_id (str): Идентификатор клиента.
-        seller_token (str): Токен продавца.
 
     Returns:
         dict: Результат обновления остатков.
 
     Examples:
         Пример корректного использования:
-        update_stocks([{"offer_id": "12345", "stock": 10}], "client123", "token123")
+        await update_stocks(client, [{"offer_id": "12345", "stock": 10}])
 
         Пример некорректного использования:
-        update_stocks({"offer_id": "12345", "stock": 10}, "client123", "token123")
+        await update_stocks(client, {"offer_id": "12345", "stock": 10})
     """
-    url = "https://api-seller.ozon.ru/v1/product/import/stocks"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
-    payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return await client.request("POST", "v1/product/import/stocks", {"stocks": stocks})
 
 
 def download_stock():
@@ -145,7 +154,7 @@ def download_stock():
     Скачивает файл с остатками с сайта Casio и обрабатывает его.
 
     Returns:
-        list: Список остатков часов.
+        pandas.DataFrame: Таблица остатков часов.
 
     Examples:
         Пример корректного использования:
@@ -156,20 +165,18 @@ def download_stock():
     """
     # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
+    response = _session.get(casio_url)
     response.raise_for_status()
+    # Создаем список остатков часов прямо из архива, не распаковывая его на диск:
     with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+        with archive.open("ostatki.xls") as excel_file:
+            watch_remnants = pd.read_excel(
+                io=excel_file,
+                engine="calamine",
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+            )
     return watch_remnants
 
 
@@ -178,11 +185,11 @@ def create_stocks(watch_remnants, offer_ids):
     Создает список остатков товаров для обновления.
 
     Args:
-        watch_remnants (list): Список остатков товаров с сайта Casio.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта Casio.
         offer_ids (list): Список артикулов товаров магазина Ozon.
 
     Returns:
-        list: Список остатков товаров для обновления.
+        tuple: Кортеж, содержащий два списка - ненулевые остатки и все остатки для обновления.
 
     Examples:
         Пример корректного использования:
@@ -191,23 +198,11 @@ def create_stocks(watch_remnants, offer_ids):
         Пример некорректного использования:
         create_stocks(watch_remnants, "12345")
     """
-    # Уберем то, что не загружено в seller
-    stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
-    # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append({"offer_id": offer_id, "stock": 0})
-    return stocks
+    return marketplace_client.create_stocks(
+        watch_remnants,
+        offer_ids,
+        lambda offer_id, count: {"offer_id": offer_id, "stock": count},
+    )
 
 
 def create_prices(watch_remnants, offer_ids):
@@ -215,7 +210,7 @@ def create_prices(watch_remnants, offer_ids):
     Создает список цен товаров для обновления.
 
     Args:
-        watch_remnants (list): Список остатков товаров с сайта Casio.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта Casio.
         offer_ids (list): Список артикулов товаров магазина Ozon.
 
     Returns:
@@ -228,137 +223,106 @@ def create_prices(watch_remnants, offer_ids):
         Пример некорректного использования:
         create_prices(watch_remnants, "12345")
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
-    return prices
-
-
-def price_conversion(price: str) -> str:
-    """
-    Преобразует цену из формата "5'990.00 руб." в "5990".
-
-    Args:
-        price (str): Цена в виде строки.
-
-    Returns:
-        str: Преобразованная цена в виде строки.
-
-    Examples:
-        Пример корректного использования:
-        price_conversion("5'990.00 руб.")
-
-        Пример некорректного использования:
-        price_conversion(5990)
-    """
-    return re.sub("[^0-9]", "", price.split(".")[0])
-
-
-def divide(lst: list, n: int):
-    """
-    Разделяет список на части по n элементов.
-
-    Args:
-        lst (list): Исходный список.
-        n (int): Размер частей.
-
-    Yields:
-        list: Часть списка.
-
-    Examples:
-        Пример корректного использования:
-        divide([1, 2, 3, 4, 5, 6], 2)
-
-        Пример некорректного использования:
-        divide([1, 2, 3, 4, 5, 6], "2")
-    """
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+    return marketplace_client.create_prices(
+        watch_remnants,
+        offer_ids,
+        lambda offer_id, price: {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": offer_id,
+            "old_price": "0",
+            "price": price,
+        },
+    )
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+async def upload_prices(client, watch_remnants, offer_ids):
     """
     Загружает цены товаров магазина Ozon из списка остатков.
 
     Args:
-        watch_remnants (list): Список остатков товаров с сайта Casio.
-        client_id (str): Идентификатор клиента.
-        seller_token (str): Токен продавца.
+        client (MarketplaceClient): Клиент API Ozon.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта Casio.
+        offer_ids (list): Список артикулов товаров магазина Ozon.
 
     Returns:
         list: Список цен товаров, которые были загружены.
 
     Examples:
         Пример корректного использования:
-        upload_prices(watch_remnants, "client123", "token123")
+        await upload_prices(client, watch_remnants, offer_ids)
 
         Пример некорректного использования:
-        upload_prices(watch_remnants, "client123", 12345)
+        await upload_prices(client, watch_remnants, "12345")
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    await gather_chunks(update_price(client, some_price) for some_price in divide(prices, 1000))
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(client, watch_remnants, offer_ids):
     """
     Загружает остатки товаров магазина Ozon из списка остатков.
 
     Args:
-        watch_remnants (list): Список остатков товаров с сайта Casio.
-        client_id (str): Идентификатор клиента.
-        seller_token (str): Токен продавца.
+        client (MarketplaceClient): Клиент API Ozon.
+        watch_remnants (pandas.DataFrame): Таблица остатков товаров с сайта Casio.
+        offer_ids (list): Список артикулов товаров магазина Ozon.
 
     Returns:
         tuple: Кортеж, содержащий два списка - остатки, которые были загружены и все остатки.
 
     Examples:
         Пример корректного использования:
-        upload_stocks(watch_remnants, "client123", "token123")
+        await upload_stocks(client, watch_remnants, offer_ids)
 
         Пример некорректного использования:
-        upload_stocks(watch_remnants, 12345, "token123")
+        await upload_stocks(client, watch_remnants, "12345")
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
-    stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
-    not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
+    not_empty, stocks = create_stocks(watch_remnants, offer_ids)
+    await gather_chunks(update_stocks(client, some_stock) for some_stock in divide(stocks, 100))
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
-    try:
-        offer_ids = get_offer_ids(client_id, seller_token)
-        watch_remnants = download_stock()
-        # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
-        # Поменять цены
-        prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
-    except requests.exceptions.ReadTimeout:
-        print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
-        print(error, "Ошибка соединения")
-    except Exception as error:
-        print(error, "ERROR_2")
+    offer_ids_ttl = env.int("OFFER_IDS_TTL", 3600)
+    offer_ids_cache_dir = env.path("OFFER_IDS_CACHE_DIR", OFFER_IDS_CACHE_DIR)
+    async with create_session() as session:
+        client = MarketplaceClient(
+            OZON_URL,
+            {"Client-Id": client_id, "Api-Key": seller_token},
+            session,
+        )
+        try:
+            offer_ids = await get_cached_offer_ids(
+                f"ozon_{client_id}",
+                functools.partial(get_offer_ids, client),
+                offer_ids_ttl,
+                offer_ids_cache_dir,
+            )
+            watch_remnants = download_stock()
+            # Остатки и цены загружаются независимо: ошибка в одной части не отменяет остальные
+            results = await asyncio.gather(
+                upload_stocks(client, watch_remnants, offer_ids),
+                upload_prices(client, watch_remnants, offer_ids),
+                return_exceptions=True,
+            )
+        except requests.exceptions.ReadTimeout:
+            print("Превышено время ожидания...")
+            return
+        except requests.exceptions.ConnectionError as error:
+            print(error, "Ошибка соединения")
+            return
+        except Exception as error:
+            report_error(error)
+            return
+        for result in results:
+            if isinstance(result, BaseException):
+                report_error(result)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())